@@ -1,93 +1,111 @@
 import vertexai
-from vertexai.generative_models import GenerativeModel
+from vertexai.generative_models import GenerativeModel, GenerationConfig
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
 from google.cloud import documentai
 from pdf2image import convert_from_bytes
+import pdfplumber
+import blingfire
+import bm25s
+import asyncio
+import functools
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 import re
 import cv2
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+import jinja2
+from markupsafe import escape
+import torch
+from diskcache import Cache
 from sentence_transformers import SentenceTransformer, util
+from app.cache import SimplificationCache
 
-class LegalDocumentProcessor:
-    def __init__(self):
-       
-        project_id = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
-        print("project_ID ", project_id)
-        vertexai.init(project=project_id, location="us-central1")
-    
-        self.doc_ai_client = documentai.DocumentProcessorServiceClient()
-        # Use OCR-specialized processor
-        self.processor_name = f"projects/{project_id}/locations/us/processors/b26232f7d89f7e08"
-        
-        # Initialize Gemini model
-        self.model = GenerativeModel("gemini-2.5-pro")
-        
-        # Initialize Sentence Transformer for semantic search
-        self.similarity_model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    async def extract_text_from_pdf(self, file_content: bytes, mime_type: str = "application/pdf") -> str:
-        """Preprocess PDF into images and extract text from each page using Document AI OCR processor"""
-        processed_images = self._preprocess_pdf(file_content)
-        full_text = ""
-
-        for image_content in processed_images:
-            document = documentai.RawDocument(content=image_content, mime_type="image/png")
-            request = documentai.ProcessRequest(name=self.processor_name, raw_document=document)
-            result = self.doc_ai_client.process_document(request=request)
-            full_text += result.document.text + "\n\n"
-        
-        return full_text
+# Lexical prefilter: only the top BM25 sentences per clause are embedded
+BM25_CANDIDATES_PER_CLAUSE = 50
 
-    def _preprocess_pdf(self, file_content: bytes) -> List[bytes]:
-        """Convert PDF pages to high-res binarized PNG images"""
-        images = convert_from_bytes(file_content, dpi=300)
-        processed_images = []
-        
-        for img in images:
-            open_cv_image = np.array(img.convert('RGB'))
-            gray = cv2.cvtColor(open_cv_image, cv2.COLOR_BGR2GRAY)
-            _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            _, encoded_img = cv2.imencode('.png', binary)
-            processed_images.append(encoded_img.tobytes())
-        
-        return processed_images
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "cache/embeddings")
+EMBEDDING_CACHE_SIZE_LIMIT = 2 ** 30
 
-    def _extract_clause_references(self, original_text: str, clauses: List[str]) -> Dict[str, List[str]]:
-        """Use semantic similarity to find best matching sentences in original text"""
-        clause_references = {}
-        sentences = [s.strip() for s in original_text.split('.') if len(s.strip()) > 20]
-        sentence_embeddings = self.similarity_model.encode(sentences, convert_to_tensor=True)
-        
-        for i, clause in enumerate(clauses):
-            clause_id = f"clause_{i+1}"
-            clause_embedding = self.similarity_model.encode(clause, convert_to_tensor=True)
-            hits = util.semantic_search(clause_embedding, sentence_embeddings, top_k=2)
-            matched_sentences = [sentences[hit['corpus_id']] for hit in hits[0]]
-            clause_references[clause_id] = matched_sentences
-        
-        return clause_references
+# Document AI quota guards for concurrent page OCR
+OCR_MAX_CONCURRENCY = 8
+OCR_MAX_RETRIES = 4
+# OCR quality plateaus around 200 DPI for contract scans
+OCR_DPI = 200
+# Grayscale JPEG is several times smaller than PNG and Document AI reads it natively
+OCR_JPEG_QUALITY = 85
+# Binarize only when the page histogram is clearly two-peaked (see _bimodality)
+BINARIZE_MIN_BIMODALITY = 0.85
+# Pages whose embedded text layer is at least this long skip OCR entirely
+MIN_TEXT_LAYER_CHARS = 50
 
-    def _highlight_text_with_clauses(self, original_text: str, clause_references: Dict[str, List[str]]) -> str:
-        highlighted_text = original_text
-        
-        for clause_id, references in clause_references.items():
-            for ref_text in references:
-                if ref_text and len(ref_text.strip()) > 20:
-                    highlighted_text = highlighted_text.replace(
-                        ref_text,
-                        f'<span class="highlighted-clause" data-clause-id="{clause_id}" title="Key Clause">{ref_text}</span>'
-                    )
-        
-        return highlighted_text
+GEMINI_MODEL_NAME = "gemini-2.5-pro"
 
-    async def simplify_legal_document(self, text: str, document_type: str = "contract") -> dict:
-        prompt = f"""
-You are a senior legal assistant tasked with simplifying and analyzing complex legal documents 
-so that non-lawyers can easily understand their rights, duties, and risks.
+# Input budget for the simplification prompt (~4 characters per Gemini token)
+MAX_DOCUMENT_TOKENS = 30000
+CHARS_PER_TOKEN = 4
+
+_IMPORTANCE = {"type": "string", "enum": ["High", "Medium", "Low"]}
 
-Document Type: {document_type}
+# Gemini JSON-mode schema for simplify_legal_document
+SIMPLIFY_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "SIMPLIFIED_SUMMARY": {"type": "string"},
+        "KEY_CLAUSES": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "explanation": {"type": "string"},
+                    "importance": _IMPORTANCE,
+                    "original_excerpt": {"type": "string"},
+                },
+                "required": ["title", "explanation", "importance"],
+            },
+        },
+        "RISK_ASSESSMENT": {
+            "type": "object",
+            "properties": {
+                "overall_risk": {"type": "integer"},
+                "risk_factors": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "risk": {"type": "string"},
+                            "severity": _IMPORTANCE,
+                            "details": {"type": "string"},
+                        },
+                        "required": ["risk", "severity", "details"],
+                    },
+                },
+            },
+            "required": ["overall_risk", "risk_factors"],
+        },
+        "IMPORTANT_TERMS": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "term": {"type": "string"},
+                    "definition": {"type": "string"},
+                },
+                "required": ["term", "definition"],
+            },
+        },
+        "ACTION_ITEMS": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["SIMPLIFIED_SUMMARY", "KEY_CLAUSES", "RISK_ASSESSMENT", "IMPORTANT_TERMS", "ACTION_ITEMS"],
+}
+
+# Static instruction preambles, sent once per prompt cache instead of on every request
+SIMPLIFY_INSTRUCTIONS = """You are a senior legal assistant tasked with simplifying and analyzing complex legal documents 
+so that non-lawyers can easily understand their rights, duties, and risks.
 
 Your job is to analyze the document carefully and return a structured JSON object.  
 ⚠️ The JSON must be valid and strictly follow the schema below.  
@@ -116,7 +134,9 @@ Schema and Instructions:
        - "details": Explanation of why it matters
 
 4. IMPORTANT_TERMS:
-   - List of legal terms or jargon from the document with simple definitions.
+   - List of legal terms or jargon from the document, each with:
+       - "term": The term as written in the document
+       - "definition": A simple definition
 
 5. ACTION_ITEMS:
    - A checklist of specific things the reader must do, remember, or watch out for.
@@ -126,103 +146,389 @@ Formatting Rules:
 - Return only valid JSON (no markdown code fences, no extra commentary).
 - Use HTML tags (like <p>, <strong>, <ul>, <li>) inside text fields so the content can be rendered directly.
 - Keep tone professional but friendly, like explaining to a client.
+"""
 
-Document Text:
-{text}
+QA_INSTRUCTIONS = """You are a legal assistant.
+Use the provided context from the legal document to answer the user's question.
+Do NOT make up information. If the answer is not in the context, say so.
+Answer in HTML (<p>, <strong>, <em>) format, simple and clear.
 """
 
+# Result section templates, compiled once. Autoescaping covers titles, labels and term names;
+# fields the prompt asks Gemini to write as HTML are marked |safe so their markup still renders.
+RESULT_HTML_TEMPLATES = {
+    "summary": "<div class='summary-section'><p>{{ summary|safe }}</p></div>",
+    "clause": """
+<div class='clause-item' data-clause-id='{{ clause_id }}'>
+{%- if clause is mapping %}
+    {%- set importance = clause.importance or 'Medium' %}
+    <h4 class='clause-title'>{{ clause.title or 'Clause %d' % number }}</h4>
+    <div class='clause-importance importance-{{ importance|lower }}'>
+        Importance: {{ importance }}
+    </div>
+    <p class='clause-explanation'>{{ (clause.explanation or '')|safe }}</p>
+    {%- if clause.original_excerpt %}
+    <blockquote class='original-text'>{{ clause.original_excerpt }}</blockquote>
+    {%- endif %}
+{%- else %}
+    <p class='clause-explanation'>{{ clause|safe }}</p>
+{%- endif %}
+</div>
+""",
+    "risk": """
+{%- if risk is mapping -%}
+{%- set score = risk.overall_risk or 5 -%}
+<div class='risk-assessment'>
+    <div class='overall-risk risk-level-{{ score }}'>
+        <strong>Overall Risk Score: {{ score }}/10</strong>
+    </div>
+    <ul class='risk-factors'>
+    {%- for factor in risk.risk_factors or [] %}
+        {%- if factor is mapping %}
+        <li class='risk-item'><strong>{{ factor.risk }}</strong> ({{ factor.severity }}): {{ (factor.details or '')|safe }}</li>
+        {%- else %}
+        <li class='risk-item'>{{ factor|safe }}</li>
+        {%- endif %}
+    {%- endfor %}
+    </ul>
+</div>
+{%- else -%}
+<div class='risk-assessment'><p>Risk Score: {{ risk }}/10</p></div>
+{%- endif -%}
+""",
+    "terms": """<div class='terms-section'>
+{%- for term, definition in terms.items() %}
+    <div class='term-item'>
+        <strong class='term-name'>{{ term }}</strong>:
+        <span class='term-definition'>{{ definition|safe }}</span>
+    </div>
+{%- endfor %}
+</div>""",
+    "actions": """<ul class='action-items'>
+{%- for action in actions %}<li class='action-item'>{{ action|safe }}</li>{% endfor -%}
+</ul>""",
+}
+
+
+def split_sentences(text: str, min_length: int = 20) -> List[str]:
+    """Split text with blingfire's sentence DFA, slicing by offsets so sentences match the source verbatim"""
+    if not text.strip():
+        return []
+    _, offsets = blingfire.text_to_sentences_and_offsets(text)
+    sentences = (text[start:end].strip() for start, end in offsets)
+    return [s for s in sentences if len(s) > min_length]
+
+
+def load_similarity_model():
+    """Use FP16 on the GPU when present, else FP32 on CPU"""
+    if torch.cuda.is_available():
+        return SentenceTransformer('all-MiniLM-L6-v2', device="cuda").half()
+    return SentenceTransformer('all-MiniLM-L6-v2', device="cpu")
+
+
+class LegalDocumentProcessor:
+    def __init__(self):
+       
+        project_id = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
+        print("project_ID ", project_id)
+        vertexai.init(project=project_id, location="us-central1")
+    
+        self.doc_ai_client = documentai.DocumentProcessorServiceClient()
+        # Use OCR-specialized processor
+        self.processor_name = f"projects/{project_id}/locations/us/processors/b26232f7d89f7e08"
         
-        response = self.model.generate_content(prompt)
+        self.simplify_config = GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=SIMPLIFY_RESPONSE_SCHEMA,
+            temperature=0.2,
+        )
         
+        # Initialize Sentence Transformer for semantic search
+        self.similarity_model = load_similarity_model()
+
+        # Compiled HTML templates for the formatted result sections
+        html_env = jinja2.Environment(autoescape=True)
+        self.html_templates = {
+            name: html_env.from_string(source) for name, source in RESULT_HTML_TEMPLATES.items()
+        }
+
+        # Per-sentence embeddings, shared across documents with common boilerplate
+        self.embedding_cache = Cache(
+            EMBEDDING_CACHE_DIR,
+            size_limit=EMBEDDING_CACHE_SIZE_LIMIT,
+            eviction_policy="least-recently-used",
+        )
+
+        # Exact-text cache of prior Gemini simplification results
+        self.result_cache = SimplificationCache()
+
+        # Gemini models carrying the fixed instruction preambles as system instructions
+        self.simplify_model = GenerativeModel(GEMINI_MODEL_NAME, system_instruction=SIMPLIFY_INSTRUCTIONS)
+        self.qa_model = GenerativeModel(GEMINI_MODEL_NAME, system_instruction=QA_INSTRUCTIONS)
+    
+    async def extract_text_from_pdf(self, file_content: bytes, mime_type: str = "application/pdf") -> str:
+        """Use the embedded text layer where present and OCR the remaining pages with Document AI"""
+        page_texts = self._extract_text_layer(file_content)
+        ocr_pages = [page_no for page_no, text in enumerate(page_texts, 1) if text is None]
+
+        if ocr_pages or not page_texts:
+            processed_images = self._preprocess_pdf(file_content, ocr_pages or None)
+            semaphore = asyncio.Semaphore(OCR_MAX_CONCURRENCY)
+
+            # OCR all pages concurrently; gather keeps the results in page order
+            ocr_texts = await asyncio.gather(
+                *[self._ocr_page(image_content, semaphore) for image_content in processed_images]
+            )
+            if not page_texts:
+                page_texts = list(ocr_texts)
+            for page_no, text in zip(ocr_pages, ocr_texts):
+                page_texts[page_no - 1] = text
+
+        return "".join(text + "\n\n" for text in page_texts)
+
+    def _extract_text_layer(self, file_content: bytes) -> List[Optional[str]]:
+        """Per-page embedded text, or None for pages that need OCR (empty list if unreadable)"""
         try:
-            clean_text = response.text.strip()
+            with pdfplumber.open(io.BytesIO(file_content)) as pdf:
+                page_texts = []
+                for page in pdf.pages:
+                    text = page.extract_text() or ""
+                    page_texts.append(text if len(text.strip()) > MIN_TEXT_LAYER_CHARS else None)
+                return page_texts
+        except Exception as e:
+            print("Could not read PDF text layer, falling back to OCR:", e)
+            return []
+
+    async def _ocr_page(self, image_content: bytes, semaphore: asyncio.Semaphore) -> str:
+        """Run one Document AI request off the event loop, retrying transient 429/503s"""
+        document = documentai.RawDocument(content=image_content, mime_type="image/jpeg")
+        request = documentai.ProcessRequest(name=self.processor_name, raw_document=document)
+        process = functools.partial(self.doc_ai_client.process_document, request=request)
+        loop = asyncio.get_running_loop()
+
+        async with semaphore:
+            for attempt in range(OCR_MAX_RETRIES):
+                try:
+                    result = await loop.run_in_executor(None, process)
+                    return result.document.text
+                except (ResourceExhausted, ServiceUnavailable):
+                    if attempt == OCR_MAX_RETRIES - 1:
+                        raise
+                    await asyncio.sleep(2 ** attempt)
+
+    def _preprocess_pdf(self, file_content: bytes, pages: Optional[List[int]] = None) -> List[bytes]:
+        """Convert PDF pages (1-based, all if None) to grayscale JPEG images for OCR"""
+        # Poppler rasterizes pages in parallel and returns single-channel images directly
+        convert = functools.partial(
+            convert_from_bytes, file_content, dpi=OCR_DPI, grayscale=True, thread_count=os.cpu_count() or 1
+        )
+        if pages is None:
+            images = convert()
+        else:
+            images = []
+            for first_page, last_page in self._page_runs(pages):
+                images.extend(convert(first_page=first_page, last_page=last_page))
+
+        # OpenCV releases the GIL, so per-page binarization scales across threads
+        with ThreadPoolExecutor() as executor:
+            return list(executor.map(self._encode_page, images))
+
+    @staticmethod
+    def _page_runs(pages: List[int]) -> List[Tuple[int, int]]:
+        """Group sorted page numbers into contiguous (first, last) ranges"""
+        runs = []
+        for page_no in pages:
+            if runs and page_no == runs[-1][1] + 1:
+                runs[-1] = (runs[-1][0], page_no)
+            else:
+                runs.append((page_no, page_no))
+        return runs
+
+    @staticmethod
+    def _encode_page(img) -> bytes:
+        gray = np.asarray(img)
+        # Otsu only helps clearly two-tone scans; it can erase light text, so skip it otherwise
+        if LegalDocumentProcessor._bimodality(gray) >= BINARIZE_MIN_BIMODALITY:
+            _, gray = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        _, encoded_img = cv2.imencode('.jpg', gray, [cv2.IMWRITE_JPEG_QUALITY, OCR_JPEG_QUALITY])
+        return encoded_img.tobytes()
+
+    @staticmethod
+    def _bimodality(gray: np.ndarray) -> float:
+        """Otsu separability: best between-class variance over total variance (1.0 = two clean peaks)"""
+        hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+        p = hist / max(hist.sum(), 1.0)
+        levels = np.arange(256, dtype=np.float64)
+        omega = np.cumsum(p)
+        mu = np.cumsum(p * levels)
+        mu_total = mu[-1]
+        total_variance = float(((levels - mu_total) ** 2 * p).sum())
+        if total_variance == 0:
+            return 0.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            between_variance = (mu_total * omega - mu) ** 2 / (omega * (1.0 - omega))
+        return float(np.nanmax(np.where(np.isfinite(between_variance), between_variance, np.nan)) / total_variance)
+
+    def _extract_clause_references(
+        self, original_text: str, clauses: List[str], clause_ids: Optional[List[str]] = None
+    ) -> Dict[str, List[str]]:
+        """Use semantic similarity to find best matching sentences in original text"""
+        clause_references = {}
+        clause_ids = clause_ids or [f"clause_{i+1}" for i in range(len(clauses))]
+        sentences = split_sentences(original_text)
+        if not sentences or not clauses:
+            return clause_references
+
+        # Encode every clause in one batched forward pass and search with the full query matrix
+        clause_embeddings = self.similarity_model.encode(
+            clauses, batch_size=32, convert_to_tensor=True, show_progress_bar=False
+        )
+
+        if len(sentences) <= BM25_CANDIDATES_PER_CLAUSE:
+            # Cached vectors are float32; match the encoder's dtype (FP16 on GPU) for the search
+            sentence_embeddings = self._encode_sentences(sentences).to(clause_embeddings.dtype)
+            hits_all = util.semantic_search(clause_embeddings, sentence_embeddings, top_k=2)
+            for i, hits in enumerate(hits_all):
+                clause_references[clause_ids[i]] = [sentences[hit['corpus_id']] for hit in hits]
+            return clause_references
+
+        # Long documents: embed only the union of each clause's BM25 candidates,
+        # then rank every clause against its own candidates in one masked similarity matrix
+        candidate_ids = self._bm25_candidates(sentences, clauses)
+        union_ids = sorted({sentence_id for ids in candidate_ids for sentence_id in ids})
+        position = {sentence_id: p for p, sentence_id in enumerate(union_ids)}
+        union_embeddings = self._encode_sentences([sentences[j] for j in union_ids])
+
+        scores = util.cos_sim(clause_embeddings, union_embeddings.to(clause_embeddings.dtype))
+        allowed = torch.zeros_like(scores, dtype=torch.bool)
+        for i, ids in enumerate(candidate_ids):
+            allowed[i, [position[j] for j in ids]] = True
+        scores = scores.masked_fill(~allowed, float("-inf"))
+        top_positions = torch.topk(scores, k=min(2, len(union_ids)), dim=1).indices.tolist()
+
+        for i, positions in enumerate(top_positions):
+            clause_references[clause_ids[i]] = [sentences[union_ids[p]] for p in positions]
+        
+        return clause_references
+
+    @staticmethod
+    def _bm25_candidates(sentences: List[str], clauses: List[str]) -> List[List[int]]:
+        """Top BM25 sentence indices for each clause"""
+        retriever = bm25s.BM25()
+        retriever.index(bm25s.tokenize(sentences, stopwords="en", show_progress=False), show_progress=False)
+        results, _ = retriever.retrieve(
+            bm25s.tokenize(clauses, stopwords="en", show_progress=False),
+            k=BM25_CANDIDATES_PER_CLAUSE,
+            show_progress=False,
+        )
+        return [[int(j) for j in row] for row in results]
+
+    def _encode_sentences(self, sentences: List[str]) -> torch.Tensor:
+        """Embed sentences, reusing cached vectors and encoding only the misses in one batch"""
+        # Key on the encoder class too, so vectors from a different encoder are never mixed in
+        model_tag = type(self.similarity_model).__name__.encode()
+        keys = [hashlib.blake2b(model_tag + b"\0" + s.encode("utf-8"), digest_size=16).digest() for s in sentences]
 
-            if clean_text.startswith("json"):
-                clean_text = clean_text.replace("json", "", 1).strip()
+        with self.embedding_cache.transact():
+            embeddings = [self.embedding_cache.get(key) for key in keys]
 
-            if clean_text.startswith("```"):
-                clean_text = re.sub(r"^```(json)?", "", clean_text).strip()
-                clean_text = re.sub(r"```$", "", clean_text).strip()
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if misses:
+            encoded = self.similarity_model.encode(
+                [sentences[i] for i in misses], batch_size=32, show_progress_bar=False
+            )
+            with self.embedding_cache.transact():
+                for i, embedding in zip(misses, encoded):
+                    embeddings[i] = np.asarray(embedding, dtype=np.float32)
+                    self.embedding_cache.set(keys[i], embeddings[i])
 
-            result = json.loads(clean_text)
+        device = getattr(self.similarity_model, "device", "cpu")
+        return torch.from_numpy(np.stack(embeddings)).to(device)
+
+    def _highlight_text_with_clauses(self, original_text: str, clause_references: Dict[str, List[str]]) -> str:
+        ref_to_clause_id = {}
+        for clause_id, references in clause_references.items():
+            for ref_text in references:
+                if ref_text and len(ref_text.strip()) > 20:
+                    ref_to_clause_id.setdefault(ref_text, clause_id)
+
+        if not ref_to_clause_id:
+            return original_text
+
+        # One alternation pass over the text; longest references first so none is shadowed by a prefix
+        pattern = re.compile("|".join(
+            re.escape(ref_text) for ref_text in sorted(ref_to_clause_id, key=len, reverse=True)
+        ))
+        return pattern.sub(
+            lambda m: f'<span class="highlighted-clause" data-clause-id="{ref_to_clause_id[m.group(0)]}" title="Key Clause">{m.group(0)}</span>',
+            original_text
+        )
+
+    async def simplify_legal_document(self, text: str, document_type: str = "contract") -> dict:
+        cache_key = self.result_cache.make_key(text, document_type)
+        cached_result = self.result_cache.get(cache_key)
+        if cached_result is not None:
+            return cached_result
+
+        prompt = f"""Document Type: {document_type}
+
+Document Text:
+{text[:MAX_DOCUMENT_TOKENS * CHARS_PER_TOKEN]}
+"""
+
+        
+        response = self.simplify_model.generate_content(
+            prompt, generation_config=self.simplify_config
+        )
+        
+        try:
+            # JSON mode returns bare schema-conformant JSON; this only fails on truncated output
+            result = json.loads(response.text)
             formatted_result = self._format_response_with_html(result, text)
+            self.result_cache.put(cache_key, formatted_result)
             return formatted_result
             
         except json.JSONDecodeError:
+            # Same shape as _format_response_with_html: every section is an HTML string
+            templates = self.html_templates
             return {
-                "SIMPLIFIED_SUMMARY": {response.text},
-                "KEY_CLAUSES": [{"title": "Unable to parse", "explanation": "Please review manually", "importance": "Medium"}],
-                "RISK_ASSESSMENT": {"overall_risk": 5, "risk_factors": []},
-                "IMPORTANT_TERMS": {},
-                "ACTION_ITEMS": ["<p>Review document carefully</p>"],
-                "highlighted_document": f"<div class='document-text'>{text}</div>"
+                "SIMPLIFIED_SUMMARY": templates["summary"].render(summary=escape(response.text)),
+                "KEY_CLAUSES": [templates["clause"].render(
+                    clause_id="clause_1",
+                    number=1,
+                    clause={"title": "Unable to parse", "explanation": "Please review manually", "importance": "Medium"},
+                )],
+                "RISK_ASSESSMENT": templates["risk"].render(risk={"overall_risk": 5, "risk_factors": []}),
+                "IMPORTANT_TERMS": templates["terms"].render(terms={}),
+                "ACTION_ITEMS": templates["actions"].render(actions=["<p>Review document carefully</p>"]),
+                "highlighted_document": f"<div class='document-text'>{text}</div>",
+                "clause_references": {}
             }
 
     def _format_response_with_html(self, result: dict, original_text: str) -> dict:
-        summary = result.get("SIMPLIFIED_SUMMARY", "")
-        formatted_summary = f"<div class='summary-section'><p>{summary}</p></div>"
+        templates = self.html_templates
+        formatted_summary = templates["summary"].render(summary=result.get("SIMPLIFIED_SUMMARY", ""))
         
         clauses = result.get("KEY_CLAUSES", [])
-        formatted_clauses = []
-        clause_texts = []
+        formatted_clauses = [
+            templates["clause"].render(clause_id=f"clause_{i+1}", number=i + 1, clause=clause)
+            for i, clause in enumerate(clauses)
+        ]
+        clause_texts = [
+            clause.get('explanation', '') if isinstance(clause, dict) else str(clause)
+            for clause in clauses
+        ]
         
-        for i, clause in enumerate(clauses):
-            if isinstance(clause, dict):
-                clause_html = f"""
-                <div class='clause-item' data-clause-id='clause_{i+1}'>
-                    <h4 class='clause-title'>{clause.get('title', f'Clause {i+1}')}</h4>
-                    <div class='clause-importance importance-{clause.get('importance', 'medium').lower()}'>
-                        Importance: {clause.get('importance', 'Medium')}
-                    </div>
-                    <p class='clause-explanation'>{clause.get('explanation', '')}</p>
-                    {f"<blockquote class='original-text'>{clause.get('original_excerpt', '')}</blockquote>" if clause.get('original_excerpt') else ''}
-                </div>
-                """
-                formatted_clauses.append(clause_html)
-                clause_texts.append(clause.get('explanation', ''))
-            else:
-                clause_html = f"""
-                <div class='clause-item' data-clause-id='clause_{i+1}'>
-                    <p class='clause-explanation'>{clause}</p>
-                </div>
-                """
-                formatted_clauses.append(clause_html)
-                clause_texts.append(str(clause))
-        
-        risk_data = result.get("RISK_ASSESSMENT", {})
-        if isinstance(risk_data, dict):
-            risk_html = f"""
-            <div class='risk-assessment'>
-                <div class='overall-risk risk-level-{risk_data.get('overall_risk', 5)}'>
-                    <strong>Overall Risk Score: {risk_data.get('overall_risk', 5)}/10</strong>
-                </div>
-                <ul class='risk-factors'>
-                    {' '.join([f"<li class='risk-item'>{factor}</li>" for factor in risk_data.get('risk_factors', [])])}
-                </ul>
-            </div>
-            """
-        else:
-            risk_html = f"<div class='risk-assessment'><p>Risk Score: {risk_data}/10</p></div>"
+        risk_html = templates["risk"].render(risk=result.get("RISK_ASSESSMENT", {}))
         
         terms = result.get("IMPORTANT_TERMS", {})
-        terms_html = "<div class='terms-section'>"
-        if isinstance(terms, dict):
-            for term, definition in terms.items():
-                terms_html += f"""
-                <div class='term-item'>
-                    <strong class='term-name'>{term}</strong>: 
-                    <span class='term-definition'>{definition}</span>
-                </div>
-                """
-        terms_html += "</div>"
+        if isinstance(terms, list):
+            terms = {t.get("term", ""): t.get("definition", "") for t in terms if isinstance(t, dict)}
+        terms_html = templates["terms"].render(terms=terms if isinstance(terms, dict) else {})
         
-        actions = result.get("ACTION_ITEMS", [])
-        actions_html = "<ul class='action-items'>"
-        for action in actions:
-            actions_html += f"<li class='action-item'>{action}</li>"
-        actions_html += "</ul>"
+        actions_html = templates["actions"].render(actions=result.get("ACTION_ITEMS", []))
         
-        clause_references = self._extract_clause_references(original_text, clause_texts)
+        clause_references = self._resolve_clause_references(original_text, clauses, clause_texts)
         highlighted_document = self._highlight_text_with_clauses(original_text, clause_references)
         
         return {
@@ -235,8 +541,27 @@ Document Text:
             "clause_references": clause_references
         }
 
+    def _resolve_clause_references(self, original_text: str, clauses: list, clause_texts: List[str]) -> Dict[str, List[str]]:
+        """Use Gemini's verbatim excerpts where they check out; semantic-search only the rest"""
+        clause_ids = [f"clause_{i+1}" for i in range(len(clauses))]
+        references = {}
+        search_ids, search_texts = [], []
+
+        for clause_id, clause, clause_text in zip(clause_ids, clauses, clause_texts):
+            excerpt = (clause.get('original_excerpt') or '').strip() if isinstance(clause, dict) else ''
+            if len(excerpt) > 20 and excerpt in original_text:
+                references[clause_id] = [excerpt]
+            else:
+                search_ids.append(clause_id)
+                search_texts.append(clause_text)
+
+        if search_texts:
+            references.update(self._extract_clause_references(original_text, search_texts, search_ids))
+
+        return {clause_id: references[clause_id] for clause_id in clause_ids if clause_id in references}
+
     async def answer_document_question(self, document_text: str, question: str) -> str:
-        sentences = [s.strip() for s in document_text.split('.') if len(s.strip()) > 20]
+        sentences = split_sentences(document_text)
         
         sentence_embeddings = self.similarity_model.encode(sentences, convert_to_tensor=True)
         question_embedding = self.similarity_model.encode(question, convert_to_tensor=True)
@@ -246,18 +571,11 @@ Document Text:
 
         context = "\n".join(retrieved_passages)
 
-        prompt = f"""
-        You are a legal assistant. 
-        Use the provided context from the legal document to answer the user's question.
-        Do NOT make up information. If the answer is not in the context, say so.
+        prompt = f"""Context:
+{context}
 
-        Context:
-        {context}
-
-        Question: {question}
-
-        Answer in HTML (<p>, <strong>, <em>) format, simple and clear:
-        5"""
+Question: {question}
+"""
         
-        response = self.model.generate_content(prompt)
+        response = self.qa_model.generate_content(prompt)
         return f"<div class='qa-response'>{response.text}</div>"
@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+SIMPLIFY_CACHE_PATH = os.getenv("SIMPLIFY_CACHE_PATH", "cache/simplify_cache.sqlite3")
+
+
+class SimplificationCache:
+    """Cache of formatted Gemini results keyed by a hash of the exact document text and type.
+
+    Near-duplicate matching is deliberately not done: two leases from one template differ in
+    parties, amounts and dates, so reusing one's analysis for the other would be wrong and
+    would expose the first document's details.
+    """
+
+    def __init__(self, path: str = SIMPLIFY_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS simplify_results (
+                key TEXT PRIMARY KEY,
+                formatted_result TEXT
+            )"""
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text: str, document_type: str) -> str:
+        return hashlib.sha256(f"{document_type}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the fully formatted result for an identical document"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT formatted_result FROM simplify_results WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, formatted_result: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO simplify_results (key, formatted_result) VALUES (?, ?)",
+                (key, json.dumps(formatted_result)),
+            )
+            self._conn.commit()
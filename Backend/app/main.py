@@ -1,14 +1,89 @@
 from datetime import datetime
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models
 from app.ai_services import LegalDocumentProcessor
-import json
+import gzip
+import hashlib
+import io
 from typing import Optional
 import os 
+import tempfile
+import zlib
+import zstandard
+
+# Request bodies the frontend may send compressed (Content-Encoding header)
+REQUEST_BODY_DECODERS = {
+    "zstd": lambda body: zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body), read_across_frames=True),
+    "gzip": lambda body: gzip.GzipFile(fileobj=io.BytesIO(body)),
+}
+# One ceiling for every request body, counted after decompression, so a tiny compressed
+# payload cannot exhaust memory and compressed and plain uploads are held to the same size
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+DECOMPRESS_CHUNK_BYTES = 1024 * 1024
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Request body exceeds {MAX_UPLOAD_BYTES} bytes")
+
+async def read_body(request: Request) -> bytes:
+    """Buffer the raw body, stopping with 413 once it passes MAX_UPLOAD_BYTES"""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise _too_large()
+    chunks = []
+    total = 0
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise _too_large()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def inflate_body(reader) -> bytes:
+    """Read a decompressing stream in chunks, stopping with 413 once it passes MAX_UPLOAD_BYTES"""
+    chunks = []
+    total = 0
+    while True:
+        chunk = reader.read(DECOMPRESS_CHUNK_BYTES)
+        if not chunk:
+            return b"".join(chunks)
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise _too_large()
+        chunks.append(chunk)
+
+class DecompressingRoute(APIRoute):
+    """Route that caps request bodies and transparently inflates zstd/gzip ones before form parsing"""
+
+    def get_route_handler(self):
+        original_handler = super().get_route_handler()
+
+        async def handler(request: Request):
+            encoding = request.headers.get("content-encoding", "").strip().lower()
+            decode = None
+            if encoding not in ("", "identity"):
+                decode = REQUEST_BODY_DECODERS.get(encoding)
+                if decode is None:
+                    raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+            body = await read_body(request)
+            if decode is not None:
+                try:
+                    # Decompression is CPU-bound; keep it off the event loop
+                    body = await run_in_threadpool(inflate_body, decode(body))
+                except (OSError, EOFError, zlib.error, zstandard.ZstdError):
+                    raise HTTPException(status_code=400, detail="Malformed compressed request body")
+            # Form parsing streams from the cached body, so setting it is enough
+            request._body = body
+            return await original_handler(request)
+
+        return handler
 
 app = FastAPI(title="Legal Document Simplifier API")
+app.router.route_class = DecompressingRoute
 
 # CORS middleware
 app.add_middleware(
@@ -19,31 +94,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create tables
-models.Base.metadata.create_all(bind=models.engine)
-
 # Initialize AI processor
 ai_processor = LegalDocumentProcessor()
 
+@app.on_event("startup")
+async def create_tables():
+    async with models.engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+
+@app.on_event("startup")
+async def warm_up_models():
+    """Pay the encoder cold-start cost at boot instead of on the first upload"""
+    ai_processor.similarity_model.encode(["warmup"], show_progress_bar=False)
+
 SAVE_DIR = "extracted_texts"
 os.makedirs(SAVE_DIR, exist_ok=True)
 
-def convert_sets_to_lists(obj):
-    """Recursively convert sets to lists for JSON serialization"""
-    if isinstance(obj, set):
-        return list(obj)
-    elif isinstance(obj, dict):
-        return {key: convert_sets_to_lists(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_sets_to_lists(item) for item in obj]
-    return obj
+# OCR output keyed by PDF content hash, so re-uploads of the same file skip Document AI
+OCR_CACHE_DIR = os.path.join(SAVE_DIR, "ocr_cache")
+os.makedirs(OCR_CACHE_DIR, exist_ok=True)
 
+def read_ocr_cache(content_hash: str) -> Optional[str]:
+    cache_path = os.path.join(OCR_CACHE_DIR, f"{content_hash}.txt")
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def write_ocr_cache(content_hash: str, text: str) -> None:
+    """Write via a temp file + rename so concurrent readers never see a partial entry"""
+    fd, tmp_path = tempfile.mkstemp(dir=OCR_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, os.path.join(OCR_CACHE_DIR, f"{content_hash}.txt"))
+    except Exception:
+        os.remove(tmp_path)
+        raise
 
 @app.post("/upload-document/")
 async def upload_document(
     file: UploadFile = File(...),
     document_type: str = "contract",
-    db: Session = Depends(models.get_db)
+    db: AsyncSession = Depends(models.get_db)
 ):
     """Upload and process legal document with debug prints"""
     
@@ -63,10 +156,16 @@ async def upload_document(
 
 
         if file.filename.endswith('.pdf'):
-            print("Processing as PDF...")
-            extracted_text = await ai_processor.extract_text_from_pdf(
-                file_content, "application/pdf"
-            )
+            content_hash = hashlib.blake2b(file_content, digest_size=16).hexdigest()
+            extracted_text = read_ocr_cache(content_hash)
+            if extracted_text is not None:
+                print("OCR cache hit:", content_hash)
+            else:
+                print("Processing as PDF...")
+                extracted_text = await ai_processor.extract_text_from_pdf(
+                    file_content, "application/pdf"
+                )
+                write_ocr_cache(content_hash, extracted_text)
         else:
             print("Processing as TXT/DOCX...")
             extracted_text = file_content.decode('utf-8', errors='ignore')
@@ -86,28 +185,27 @@ async def upload_document(
             extracted_text, document_type
         )
         print("AI processing complete")
-        
-        simplified_result_clean = convert_sets_to_lists(simplified_result)
 
-        # Save to database
-        db_document = models.Document(
+        # Commit before responding so the returned ID can be queried immediately
+        risk_score = simplified_result.get("RISK_ASSESSMENT", 5)
+        document = models.Document(
             filename=file.filename,
             original_text=extracted_text,
-            simplified_text=json.dumps(simplified_result_clean),
-            risk_score=simplified_result.get("RISK_ASSESSMENT", 5),
-            key_clauses=json.dumps(simplified_result.get("KEY_CLAUSES", [])),
+            simplified_text=simplified_result,
+            risk_score=risk_score,
+            key_clauses=simplified_result.get("KEY_CLAUSES", []),
             processing_status="completed"
         )
-        db.add(db_document)
-        db.commit()
-        db.refresh(db_document)
-        print("Document saved to DB with ID:", db_document.id)
+        db.add(document)
+        await db.commit()
+        document_id = document.id
+        print("Document saved to DB with ID:", document_id)
         
         return {
-            "document_id": db_document.id,
+            "document_id": document_id,
             "filename": file.filename,
             "simplified_result": simplified_result,
-            "risk_score": db_document.risk_score
+            "risk_score": risk_score
         }
 
     except Exception as e:
@@ -117,12 +215,10 @@ async def upload_document(
 
 
 @app.get("/document/{document_id}")
-async def get_document(document_id: int, db: Session = Depends(models.get_db)):
+async def get_document(document_id: int, db: AsyncSession = Depends(models.get_db)):
     """Get processed document by ID"""
     
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
+    document = await db.get(models.Document, document_id)
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -131,7 +227,7 @@ async def get_document(document_id: int, db: Session = Depends(models.get_db)):
         "id": document.id,
         "filename": document.filename,
         "original_text": document.original_text,
-        "simplified_result": json.loads(document.simplified_text),
+        "simplified_result": document.simplified_text,
         "risk_score": document.risk_score,
         "upload_timestamp": document.upload_timestamp
     }
@@ -140,14 +236,12 @@ async def get_document(document_id: int, db: Session = Depends(models.get_db)):
 async def ask_question(
     document_id: int,
     question: str,
-    db: Session = Depends(models.get_db)
+    db: AsyncSession = Depends(models.get_db)
 ):
     """Ask a question about a specific document"""
     print("document_id and question", document_id, question)
     
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
+    document = await db.get(models.Document, document_id)
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -1,9 +1,9 @@
 from sqlalchemy import Column, Integer, String, Text, DateTime
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from sqlalchemy.dialects.postgresql import JSON  # ✅ Add this for JSON support
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.dialects.postgresql import JSON, JSONB  # ✅ Add this for JSON support
 from datetime import datetime
+import orjson
 import os
 
 from dotenv import load_dotenv
@@ -17,7 +17,7 @@ class Document(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, index=True)
     original_text = Column(Text)
-    simplified_text = Column(Text)
+    simplified_text = Column(JSONB)   # stored as JSONB, no json.dumps/loads round trip
     risk_score = Column(JSON)         # ✅ Changed from Float to JSON
     key_clauses = Column(JSON)        # ✅ Changed from Text to JSON
     upload_timestamp = Column(DateTime, default=datetime.utcnow)
@@ -26,12 +26,26 @@ class Document(Base):
 # Database connection
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Use the asyncpg driver; the compose file still passes a plain postgresql:// URL
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-def get_db():
-    db = SessionLocal()
-    try:
+def _json_default(obj):
+    """orjson fallback: sets (e.g. from the AI fallback response) become lists"""
+    if isinstance(obj, set):
+        return list(obj)
+    raise TypeError
+
+# JSON/JSONB columns are encoded and decoded by orjson in a single native pass
+engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    json_serializer=lambda obj: orjson.dumps(obj, default=_json_default).decode(),
+    json_deserializer=orjson.loads,
+)
+AsyncSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
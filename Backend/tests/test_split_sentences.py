@@ -0,0 +1,19 @@
+from app.ai_services import split_sentences
+
+
+def test_blank_text_has_no_sentences():
+    assert split_sentences("") == []
+    assert split_sentences("   \n\t") == []
+
+
+def test_sentences_are_sliced_verbatim_from_non_ascii_text():
+    text = "The monthly rent is ₹25,000 payable in advance.  The tenant’s deposit is refundable on exit."
+    assert split_sentences(text) == [
+        "The monthly rent is ₹25,000 payable in advance.",
+        "The tenant’s deposit is refundable on exit.",
+    ]
+
+
+def test_short_fragments_are_dropped():
+    text = "Signed. This agreement is governed by the laws of India."
+    assert split_sentences(text) == ["This agreement is governed by the laws of India."]
@@ -1,96 +1,243 @@
 import streamlit as st
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+import orjson
 import re
 import os
+import secrets
 import hashlib
+import sqlite3
+import time
+import zlib
+from contextlib import closing
 from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from blake3 import blake3 as _file_hasher
+except ImportError:
+    _file_hasher = hashlib.sha256  # SHA-NI accelerated on modern x86
+
+HASH_CHUNK_SIZE = 1 << 20
+DOC_CACHE_PATH = os.getenv("DOC_CACHE_PATH", ".doc_cache.sqlite3")
+# Upload body compression: "zstd" (gzip if zstandard is missing), "gzip", or "none" to disable
+UPLOAD_COMPRESSION = os.getenv("UPLOAD_COMPRESSION", "zstd").lower()
+if UPLOAD_COMPRESSION == "zstd" and zstandard is None:
+    UPLOAD_COMPRESSION = "gzip"
+UPLOAD_CHUNK_SIZE = 1 << 16
+
 
 # API_BASE = os.getenv("API_BASE")
 API_BASE = "http://104.197.0.144:8080"
 st.set_page_config(page_title="Legal Simplifier", layout="wide")
 
+# (connect, read) timeouts in seconds; uploads include OCR + Gemini processing time
+UPLOAD_TIMEOUT = (5, 300)
+QA_TIMEOUT = (5, 120)
+RETRY_STATUSES = (502, 503, 504)
+QA_MAX_ATTEMPTS = 3
+# Chat turns rendered as individual bubbles on each rerun
+CHAT_WINDOW = 50
+
+@st.cache_resource
+def get_session():
+    """One pooled keep-alive session for uploads and questions, shared across reruns and sessions."""
+    session = requests.Session()
+    session.headers["Connection"] = "keep-alive"
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        # POST stays out of allowed_methods: a streamed upload body cannot be replayed,
+        # so only connection failures (nothing sent yet) are retried here
+        max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Markdown fence cleanup patterns, compiled once (the head also eats a bare leading "json" line)
+_FENCE_HEAD = re.compile(r"^\s*(?:json[ \t]*\n)?(?:```(?:json)?)?\s*", re.I)
+_FENCE_TAIL = re.compile(r"```\s*$")
+
 # ---------------------------
 # Helpers
 # ---------------------------
+def _json(resp):
+    """Decode a backend response body with orjson instead of requests' stdlib json."""
+    return orjson.loads(resp.content)
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def ask(document_id, question):
+    """Backend answer for a question; repeated (document, question) pairs skip the network."""
+    # Questions carry no body and have no side effects, so gateway errors are safe to retry
+    for attempt in range(QA_MAX_ATTEMPTS):
+        response = get_session().post(
+            f"{API_BASE}/ask-question/",
+            params={"document_id": document_id, "question": question},
+            timeout=QA_TIMEOUT,
+        )
+        if response.status_code not in RETRY_STATUSES or attempt == QA_MAX_ATTEMPTS - 1:
+            break
+        time.sleep(0.5 * 2 ** attempt)
+    response.raise_for_status()  # errors propagate and are never cached
+    return _json(response)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _parse_text(text, fenced):
+    """Pure str -> dict parse, memoized so identical backend answers are parsed once."""
+    if fenced:
+        clean = _FENCE_HEAD.sub("", text, count=1)
+        clean = _FENCE_TAIL.sub("", clean).strip()
+        return orjson.loads(clean)
+    try:
+        return orjson.loads(text)
+    except Exception:
+        return {"text": text}
+
 def parse_response(resp):
     """Clean and parse backend response into proper JSON/dict."""
+    if isinstance(resp, dict):
+        return resp
     if isinstance(resp, list) and len(resp) > 0 and isinstance(resp[0], str):
-        clean = resp[0].replace("json\n", "").strip()
-        clean = re.sub(r"^```(json)?", "", clean).strip()
-        clean = re.sub(r"```$", "", clean).strip()
-        return json.loads(clean)
+        return _parse_text(resp[0], True)
     if isinstance(resp, str):
-        try:
-            return json.loads(resp)
-        except Exception:
-            return {"text": resp}
+        return _parse_text(resp, False)
     return resp
 
+def answer_text(ans):
+    """Displayable text of a parsed chat answer."""
+    if isinstance(ans, dict) and "text" in ans:
+        return ans["text"]
+    return str(ans)
+
+_SEV_ICON = {"high": "🔴", "medium": "🟡", "low": "🟢"}
+
+def _format_risk_row(r):
+    """Markdown for one risk entry."""
+    if not isinstance(r, dict):
+        return str(r)
+    get = r.get  # bound once; reused for every field below
+    severity = get("severity", "")
+    sev_icon = _SEV_ICON.get(severity.lower(), "🟢")
+    # `or` short-circuits, so the common case ("details" present) is a single lookup
+    detail_text = get("details") or get("description") or get("explanation") or ""
+    return f"""**Risk:** {get('risk', '')}
+- **Severity:** {sev_icon} {severity}
+- **Details:** {detail_text}
+
+---"""
+
 def render_risk_assessment(risk_data):
     """Render risk assessment section in a structured way."""
+    if isinstance(risk_data, str):
+        st.html(risk_data)  # pre-rendered HTML from the backend
+        return
+    if not isinstance(risk_data, (dict, list)):
+        st.info("No risk assessment data available.")
+        return
+
+    # Build the whole section and send it to the browser in one markdown element
+    parts = []
     if isinstance(risk_data, dict):
         overall_score = (
             risk_data.get("Overall Risk Score")
             or risk_data.get("overall_score")
             or "N/A"
         )
-        st.markdown(f"**Overall Risk Score:** {overall_score}")
-
-        risks = risk_data.get("risks", [])
-        for r in risks:
-            severity = r.get("severity", "")
-            sev_icon = (
-                "🔴" if severity.lower() == "high"
-                else "🟡" if severity.lower() == "medium"
-                else "🟢"
-            )
-            detail_text = (
-                r.get("details")
-                or r.get("description")
-                or r.get("explanation")
-                or ""
-            )
-            st.markdown(f"**Risk:** {r.get('risk', '')}")
-            st.markdown(f"- **Severity:** {sev_icon} {severity}")
-            st.markdown(f"- **Details:** {detail_text}")
-            st.markdown("---")
-
-    elif isinstance(risk_data, list):
-        for r in risk_data:
-            if isinstance(r, dict):
-                severity = r.get("severity", "")
-                sev_icon = (
-                    "🔴" if severity.lower() == "high"
-                    else "🟡" if severity.lower() == "medium"
-                    else "🟢"
-                )
-                detail_text = (
-                    r.get("details")
-                    or r.get("description")
-                    or r.get("explanation")
-                    or ""
-                )
-                st.markdown(f"**Risk:** {r.get('risk', '')}")
-                st.markdown(f"- **Severity:** {sev_icon} {severity}")
-                st.markdown(f"- **Details:** {detail_text}")
-                st.markdown("---")
-            else:
-                st.markdown(str(r))
-
-    elif isinstance(risk_data, str):
-        st.markdown(risk_data, unsafe_allow_html=True)
+        parts.append(f"**Overall Risk Score:** {overall_score}")
+        rows = risk_data.get("risks", [])
     else:
-        st.info("No risk assessment data available.")
+        rows = risk_data
+
+    parts.extend(_format_risk_row(r) for r in rows)
+    if parts:
+        st.markdown("\n\n".join(parts))
 
 def get_file_hash(file_obj):
+    """Hash the file in 1 MiB chunks so no full-size copy is made."""
+    h = _file_hasher()
     file_obj.seek(0)
-    file_content = file_obj.read()
+    for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
+        h.update(chunk)
     file_obj.seek(0)
-    return hashlib.md5(file_content).hexdigest()
+    return h.hexdigest()
+
+def compressed_stream(reader, encoding):
+    """Yield the reader's bytes compressed chunk by chunk (level 1: upload latency over ratio)."""
+    if encoding == "zstd":
+        yield from zstandard.ZstdCompressor(level=1).read_to_iter(reader, read_size=UPLOAD_CHUNK_SIZE)
+        return
+    compressor = zlib.compressobj(1, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in iter(lambda: reader.read(UPLOAD_CHUNK_SIZE), b""):
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+class HashingReader:
+    """File wrapper that hashes bytes as they are read, so uploading and hashing share one pass."""
+
+    def __init__(self, f, h, size):
+        self.f = f
+        self.h = h
+        self.size = size
+
+    def read(self, n=-1):
+        b = self.f.read(n)
+        self.h.update(b)
+        return b
+
+    def __len__(self):
+        # The multipart encoder reads len() as "bytes still to send"
+        return self.size - self.f.tell()
+
+def doc_key(size, file_hash, doc_type):
+    return f"{size}:{file_hash}:{doc_type}"
+
+def _doc_store():
+    conn = sqlite3.connect(DOC_CACHE_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS browser_doc_history "
+        "(owner TEXT, key TEXT, filename TEXT, data BLOB, qa BLOB, updated_at REAL, PRIMARY KEY (owner, key))"
+    )
+    return conn
+
+def browser_id():
+    """Random per-browser id kept in the URL so saved documents are only visible to their owner."""
+    if "sid" not in st.query_params:
+        st.query_params["sid"] = secrets.token_urlsafe(16)
+    return st.query_params["sid"]
+
+def load_doc_history(owner):
+    """Processed documents saved by earlier sessions of this browser, oldest first."""
+    with closing(_doc_store()) as conn:
+        rows = conn.execute(
+            "SELECT key, filename, data, qa FROM browser_doc_history WHERE owner = ? ORDER BY updated_at",
+            (owner,),
+        ).fetchall()
+    return [
+        {"key": key, "filename": filename, "data": orjson.loads(data), "qa": orjson.loads(qa)}
+        for key, filename, data, qa in rows
+    ]
+
+def save_doc_entry(owner, entry):
+    with closing(_doc_store()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO browser_doc_history VALUES (?, ?, ?, ?, ?, ?)",
+            (owner, entry["key"], entry["filename"], orjson.dumps(entry["data"]), orjson.dumps(entry["qa"]), time.time()),
+        )
+
+def delete_doc_entry(owner, key):
+    with closing(_doc_store()) as conn, conn:
+        conn.execute("DELETE FROM browser_doc_history WHERE owner = ? AND key = ?", (owner, key))
 
 # ---------------------------
 # Session State
@@ -99,8 +246,37 @@ if "doc_data" not in st.session_state:
     st.session_state.doc_data = None
 if "qa_history" not in st.session_state:
     st.session_state.qa_history = []
+if "browser_id" not in st.session_state:
+    st.session_state.browser_id = browser_id()
 if "doc_history" not in st.session_state:
-    st.session_state.doc_history = []   # keep processed docs across runs
+    st.session_state.doc_history = load_doc_history(st.session_state.browser_id)   # restored across refreshes
+if "active_doc_key" not in st.session_state:
+    st.session_state.active_doc_key = None   # history entry the shown document and Q&A belong to
+if "doc_cache" not in st.session_state:
+    # "<size>:<file hash>:<doc type>" -> backend result
+    st.session_state.doc_cache = {doc["key"]: doc["data"] for doc in st.session_state.doc_history}
+
+def remember_document(cache_key, filename, result):
+    """Cache a result by content hash and make it the latest (deduplicated) history entry."""
+    st.session_state.doc_cache[cache_key] = result
+    previous = next((d for d in st.session_state.doc_history if d.get("key") == cache_key), None)
+    if previous is not None:
+        st.session_state.doc_history.remove(previous)
+    entry = previous or {"key": cache_key, "filename": filename, "data": result, "qa": []}
+    st.session_state.doc_history.append(entry)
+    save_doc_entry(st.session_state.browser_id, entry)
+    st.session_state.active_doc_key = cache_key
+    st.session_state.doc_data = result
+    st.session_state.qa_history = entry["qa"]
+
+def forget_document(cache_key):
+    """Drop a document the backend no longer knows, so the next upload processes it again."""
+    st.session_state.doc_cache.pop(cache_key, None)
+    st.session_state.doc_history = [d for d in st.session_state.doc_history if d["key"] != cache_key]
+    delete_doc_entry(st.session_state.browser_id, cache_key)
+    st.session_state.active_doc_key = None
+    st.session_state.doc_data = None
+    st.session_state.qa_history = []
 
 # ---------------------------
 # Sidebar (Document History)
@@ -108,10 +284,10 @@ if "doc_history" not in st.session_state:
 with st.sidebar:
     st.header("📂 Document History")
     if st.session_state.doc_history:
-        for i, doc in enumerate(st.session_state.doc_history, 1):
-            if st.button(f"{i}. {doc['filename']}", key=f"hist_{i}"):
-                st.session_state.doc_data = doc["data"]
-                st.session_state.qa_history = doc.get("qa", [])
+        # Iterate over a copy: opening a document moves it to the end of the history
+        for i, doc in enumerate(list(st.session_state.doc_history), 1):
+            if st.button(f"{i}. {doc['filename']}", key=f"hist_{doc['key']}"):
+                remember_document(doc["key"], doc["filename"], doc["data"])
     else:
         st.info("No history yet. Upload a doc to get started!")
 
@@ -127,22 +303,48 @@ doc_type = st.selectbox("Select Document Type", ["contract", "agreement", "polic
 if uploaded_file and st.button("🚀 Process Document"):
     with st.spinner("Processing..."):
         try:
-            files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
-            data = {"document_type": doc_type}
-            response = requests.post(f"{API_BASE}/upload-document/", files=files, data=data)
-
-            if response.status_code == 200:
-                result = response.json()
-                st.session_state.doc_data = result
-                st.session_state.qa_history = []  # reset Q&A
-                st.session_state.doc_history.append({
-                    "filename": uploaded_file.name,
-                    "data": result,
-                    "qa": []
-                })
-                st.success("✅ Document processed successfully")
+            # Only a file whose size matches a cached document can be a duplicate; hash those
+            # up front, otherwise hash while streaming so the file is read once
+            size = uploaded_file.size
+            file_hash = None
+            if any(key.startswith(f"{size}:") for key in st.session_state.doc_cache):
+                file_hash = get_file_hash(uploaded_file)
+
+            cache_key = doc_key(size, file_hash, doc_type) if file_hash else None
+            if cache_key in st.session_state.doc_cache:
+                remember_document(cache_key, uploaded_file.name, st.session_state.doc_cache[cache_key])
+                st.success("✅ Loaded previously processed document")
             else:
-                st.error("❌ Upload failed")
+                # Stream the multipart body from the file instead of building it in memory
+                uploaded_file.seek(0)
+                hasher = _file_hasher()
+                reader = uploaded_file if file_hash else HashingReader(uploaded_file, hasher, size)
+                encoder = MultipartEncoder(fields={
+                    "document_type": doc_type,
+                    "file": (uploaded_file.name, reader, uploaded_file.type),
+                })
+                upload_progress = st.progress(0.0, text="Uploading...")
+                monitor = MultipartEncoderMonitor(
+                    encoder, lambda m: upload_progress.progress(min(m.bytes_read / m.len, 1.0), text="Uploading...")
+                )
+                headers = {"Content-Type": monitor.content_type}
+                body = monitor
+                if UPLOAD_COMPRESSION in ("zstd", "gzip"):
+                    headers["Content-Encoding"] = UPLOAD_COMPRESSION
+                    body = compressed_stream(monitor, UPLOAD_COMPRESSION)
+                response = get_session().post(
+                    f"{API_BASE}/upload-document/", data=body, headers=headers, timeout=UPLOAD_TIMEOUT
+                )
+                upload_progress.empty()
+
+                if response.status_code == 200:
+                    cache_key = doc_key(size, file_hash or hasher.hexdigest(), doc_type)
+                    remember_document(cache_key, uploaded_file.name, _json(response))
+                    st.success("✅ Document processed successfully")
+                else:
+                    st.error("❌ Upload failed")
+        except requests.Timeout:
+            st.warning("⏳ The backend took too long to process this document. Please try again.")
         except Exception as e:
             st.error(f"Error: {e}")
 
@@ -156,11 +358,11 @@ if st.session_state.doc_data:
     simplified = st.session_state.doc_data.get("simplified_result", {})
 
     st.subheader("📖 Simplified Summary")
-    st.markdown(simplified.get("SIMPLIFIED_SUMMARY", ""), unsafe_allow_html=True)
+    # Backend sections are already HTML: st.html skips the markdown parser entirely
+    st.html(simplified.get("SIMPLIFIED_SUMMARY", ""))
 
     st.subheader("📌 Key Clauses")
-    for clause_html in simplified.get("KEY_CLAUSES", []):
-        st.markdown(clause_html, unsafe_allow_html=True)
+    st.html("".join(c if isinstance(c, str) else str(c) for c in simplified.get("KEY_CLAUSES", [])))
 
     st.subheader("⚠️ Risk Assessment")
 
@@ -172,10 +374,10 @@ if st.session_state.doc_data:
     render_risk_assessment(risk_data)
 
     st.subheader("📚 Important Terms")
-    st.markdown(simplified.get("IMPORTANT_TERMS", ""), unsafe_allow_html=True)
+    st.html(simplified.get("IMPORTANT_TERMS", ""))
 
     st.subheader("✅ Action Items")
-    st.markdown(simplified.get("ACTION_ITEMS", ""), unsafe_allow_html=True)
+    st.html(simplified.get("ACTION_ITEMS", ""))
 
 
     
@@ -185,43 +387,46 @@ if st.session_state.doc_data:
     # ---------------------------
     st.markdown("### 💬 Chat With Your Document")
 
-    # Show history as chat bubbles
-    for qa in st.session_state.qa_history:
+    # Show only the most recent turns as chat bubbles; older turns are built on demand
+    older_turns = st.session_state.qa_history[:-CHAT_WINDOW]
+    if older_turns and st.toggle(f"Show {len(older_turns)} earlier messages", key="show_earlier_turns"):
+        with st.container(border=True):
+            st.markdown(
+                "\n\n---\n\n".join(f"**You:** {qa['q']}\n\n{answer_text(qa['a'])}" for qa in older_turns),
+                unsafe_allow_html=True,
+            )
+
+    for qa in st.session_state.qa_history[-CHAT_WINDOW:]:
         st.chat_message("user").markdown(qa["q"])
-        ans = qa["a"] 
-        if isinstance(ans, dict) and "text" in ans:
-            st.chat_message("assistant").markdown(ans["text"], unsafe_allow_html=True)
-        else:
-            st.chat_message("assistant").markdown(str(ans), unsafe_allow_html=True)
+        st.chat_message("assistant").markdown(answer_text(qa["a"]), unsafe_allow_html=True)
 
     # Chat input
     if question := st.chat_input("Ask something about this document..."):
         with st.spinner("Thinking..."):
             try:
-                response = requests.post(
-                    f"{API_BASE}/ask-question/",
-                    params={
-                        "document_id": st.session_state.doc_data["document_id"],
-                        "question": question
-                    }
+                answer = parse_response(ask(st.session_state.doc_data["document_id"], question)["answer"])
+                entry = {
+                    "q": question,
+                    "a": answer,
+                    "time": datetime.now().strftime("%H:%M:%S")
+                }
+                st.session_state.qa_history.append(entry)
+
+                active = next(
+                    (d for d in st.session_state.doc_history if d["key"] == st.session_state.active_doc_key), None
                 )
-                if response.status_code == 200:
-                    answer = parse_response(response.json()["answer"])
-                    entry = {
-                        "q": question,
-                        "a": answer,
-                        "time": datetime.now().strftime("%H:%M:%S")
-                    }
-                    st.session_state.qa_history.append(entry)
-
-                    if st.session_state.doc_history:
-                        st.session_state.doc_history[-1]["qa"] = st.session_state.qa_history
-
-                    st.chat_message("user").markdown(question)
-                    if isinstance(answer, dict) and "text" in answer:
-                        st.chat_message("assistant").markdown(answer["text"], unsafe_allow_html=True)
-                    else:
-                        st.chat_message("assistant").markdown(str(answer), unsafe_allow_html=True)
+                if active is not None:
+                    active["qa"] = st.session_state.qa_history
+                    save_doc_entry(st.session_state.browser_id, active)
+
+                st.chat_message("user").markdown(question)
+                st.chat_message("assistant").markdown(answer_text(answer), unsafe_allow_html=True)
+            except requests.Timeout:
+                st.warning("⏳ The backend took too long to answer. Please try again.")
+            except requests.HTTPError as e:
+                if e.response.status_code == 404:
+                    forget_document(st.session_state.active_doc_key)
+                    st.error("❌ This document is no longer on the server. Please upload it again.")
                 else:
                     st.error("❌ Failed to get answer")
             except Exception as e: